@@ -1,179 +1,538 @@
 import json
+import logging
 import os
+import random
+import time
 import boto3
 import uuid
 from datetime import datetime
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+
+# orjson is faster but isn't part of the Lambda runtime; use it when it has
+# been packaged with the function (e.g. in a layer)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lambda installs a handler on the root logger; LOG_LEVEL=DEBUG shows the
+# per-call details and extracted receipt data. An unknown level falls back
+# to INFO rather than failing every invocation at import
+logger = logging.getLogger()
+LOG_LEVEL = logging.getLevelName(os.environ.get('LOG_LEVEL', 'INFO').upper())
+logger.setLevel(LOG_LEVEL if isinstance(LOG_LEVEL, int) else logging.INFO)
+
+# Larger connection pool with keep-alive, and adaptive retries so throttled
+# calls back off
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    tcp_keepalive=True
+)
+
+# Textract throttling is mostly retried by call_textract_with_backoff, so
+# botocore only makes a few attempts of its own per call
+TEXTRACT_CONFIG = BOTO_CONFIG.merge(Config(retries={'max_attempts': 3, 'mode': 'adaptive'}))
 
 # Initialize AWS clients
-s3 = boto3.client('s3')
-textract = boto3.client('textract')
-dynamodb = boto3.resource('dynamodb')
-ses = boto3.client('ses')
+s3 = boto3.client('s3', config=BOTO_CONFIG)
+textract = boto3.client('textract', config=TEXTRACT_CONFIG)
+# Plain client for all DynamoDB access: unlike resources, clients are safe to
+# share across the pool's threads, and receipt rows are built already typed
+# so they skip the resource layer's per-call serialization pass
+dynamodb_client = boto3.client('dynamodb', config=BOTO_CONFIG)
+ses = boto3.client('ses', config=BOTO_CONFIG)
+sqs = boto3.client('sqs', config=BOTO_CONFIG)
 
 # Environment variables
 DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'Receipts')
 SES_SENDER_EMAIL = os.environ.get('SES_SENDER_EMAIL', 'your-email@example.com')
 SES_RECIPIENT_EMAIL = os.environ.get('SES_RECIPIENT_EMAIL', 'recipient@example.com')
+# When set, notifications are queued here and sent by email_handler
+EMAIL_QUEUE_URL = os.environ.get('EMAIL_QUEUE_URL', '')
+# When set, Textract results are cached here keyed by S3 ETag
+RECEIPT_CACHE_TABLE = os.environ.get('RECEIPT_CACHE_TABLE', '')
+# When both are set, PDFs are analyzed with the asynchronous Textract API
+# and textract_completion_handler finishes them once the job is done
+TEXTRACT_SNS_TOPIC_ARN = os.environ.get('TEXTRACT_SNS_TOPIC_ARN', '')
+TEXTRACT_ROLE_ARN = os.environ.get('TEXTRACT_ROLE_ARN', '')
+
+# Reused across warm invocations
+POOL = ThreadPoolExecutor(max_workers=4)
+# Stateless, so safe to share between threads; used for the cached receipt
+# data, whose nested shape isn't worth typing by hand
+SERIALIZER = TypeSerializer()
+DESERIALIZER = TypeDeserializer()
+
+# Local retries for Textract throttling on top of botocore's own retries,
+# so a burst doesn't fail the invocation and force an S3 event retry.
+# Worst case per operation: 6 x 3 = 18 Textract calls, with at most ~31s of
+# local backoff plus ~3s of botocore backoff per call (~50s in total), well
+# inside the function's 3 minute timeout
+TEXTRACT_MAX_ATTEMPTS = 6
+MAX_BACKOFF_SECONDS = 20
+# Largest document Textract accepts inline as bytes
+TEXTRACT_BYTES_LIMIT = 5 * 1024 * 1024
+
+# BatchWriteItem accepts at most 25 requests; unprocessed ones are resent
+# with the same jittered backoff as Textract
+DYNAMODB_BATCH_SIZE = 25
+DYNAMODB_MAX_ATTEMPTS = 6
+
+# Textract field types mapped to the receipt_data / item keys they populate
+SUMMARY_FIELDS = {
+    'TOTAL': 'total',
+    'INVOICE_RECEIPT_DATE': 'date',
+    'VENDOR_NAME': 'vendor'
+}
+ITEM_FIELDS = {
+    'ITEM': 'name',
+    'PRICE': 'price',
+    'QUANTITY': 'quantity'
+}
+
+def to_json(value):
+    """Serialize a value to a JSON string"""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
 
 def lambda_handler(event, context):
     try:
-        # Get the S3 bucket and key from the event
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        # URL decode the key to handle spaces and special characters
-        key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
+        records = event['Records']
+        # One timestamp for the whole invocation
+        now = datetime.utcnow()
 
-        print(f"Processing receipt from {bucket}/{key}")
+        # Step 1: Process every uploaded receipt with Textract concurrently
+        futures = [POOL.submit(process_s3_record, record, now) for record in records]
 
-        # Verify the object exists before proceeding
-        try:
-            s3.head_object(Bucket=bucket, Key=key)
-            print(f"Object verification successful: {bucket}/{key}")
-        except Exception as e:
-            print(f"Object verification failed: {str(e)}")
-            raise Exception(f"Unable to access object {key} in bucket {bucket}: {str(e)}")
+        # A failed record must not discard the others, so collect failures
+        # and still store and notify the receipts that succeeded
+        receipts = []
+        errors = []
+        submitted = 0
+        for record, future in zip(records, futures):
+            # The record itself may be what's malformed, so don't index into it
+            key = urllib.parse.unquote_plus(record.get('s3', {}).get('object', {}).get('key', '<unknown>'))
+            try:
+                record_receipts = future.result()
+            except Exception as e:
+                logger.error("Error processing receipt %s: %s", key, e)
+                errors.append(f"{key}: {str(e)}")
+                continue
+
+            # Receipts handed to asynchronous Textract come back as None
+            if record_receipts is None:
+                submitted += 1
+            else:
+                receipts.extend(record_receipts)
 
-        # Step 1: Process receipt with Textract
-        receipt_data = process_receipt_with_textract(bucket, key)
+        # Steps 2 and 3
+        if receipts:
+            finish_receipts(receipts, now)
 
-        # Step 2: Store results in DynamoDB
-        store_receipt_in_dynamodb(receipt_data, bucket, key)
+        if errors:
+            raise Exception(f"{len(errors)} of {len(records)} receipts failed: {'; '.join(errors)}")
 
-        # Step 3: Send email notification
-        send_email_notification(receipt_data)
+        if submitted and not receipts:
+            return {
+                'statusCode': 202,
+                'body': to_json('Receipt submitted for analysis')
+            }
 
         return {
             'statusCode': 200,
-            'body': json.dumps('Receipt processed successfully!')
+            'body': to_json('Receipt processed successfully!')
         }
     except Exception as e:
-        print(f"Error processing receipt: {str(e)}")
+        logger.error("Error processing receipt: %s", e)
         return {
             'statusCode': 500,
-            'body': json.dumps(f'Error: {str(e)}')
+            'body': to_json(f'Error: {str(e)}')
         }
 
-def process_receipt_with_textract(bucket, key):
-    """Process receipt using Textract's AnalyzeExpense operation"""
+def process_s3_record(record, now):
+    """Extract the receipts in one S3 event record
+
+    Returns None when the object was submitted for asynchronous analysis.
+    """
+    # Get the S3 bucket and key from the event
+    bucket = record['s3']['bucket']['name']
+    # URL decode the key to handle spaces and special characters
+    key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+    # The event already carries the ETag and size, so no HEAD request is needed
+    etag = record['s3']['object'].get('eTag')
+    size = record['s3']['object'].get('size')
+
+    logger.info("Processing receipt from %s/%s", bucket, key)
+
+    # Skip Textract if this exact object has been processed before
+    # (re-upload or event redelivery)
+    receipts = get_cached_receipts(etag)
+    if receipts is not None:
+        # A redelivered event for the same object rewrites the same rows; the
+        # same file under another key is a separate object and gets its own
+        # receipts, so the original object's rows are left untouched
+        s3_path = f"s3://{bucket}/{key}"
+        return [
+            receipt_data if receipt_data['s3_path'] == s3_path
+            else dict(receipt_data, receipt_id=str(uuid.uuid4()), s3_path=s3_path)
+            for receipt_data in receipts
+        ]
+
+    if use_async_textract(key):
+        # Multi-page PDFs can take a while; don't hold the function open
+        # for it, textract_completion_handler picks up from here
+        start_textract_expense_analysis(bucket, key, etag)
+        return None
+
+    # S3 / Textract report a missing or unreadable object themselves,
+    # so there is no need for a separate HEAD request before calling it
     try:
-        print(f"Calling Textract analyze_expense for {bucket}/{key}")
-        response = textract.analyze_expense(
-            Document={
-                'S3Object': {
-                    'Bucket': bucket,
-                    'Name': key
-                }
+        receipts = process_receipt_with_textract(bucket, key, now, size)
+    except (textract.exceptions.InvalidS3ObjectException, s3.exceptions.NoSuchKey) as e:
+        logger.error("Object verification failed: %s", e)
+        raise Exception(f"Unable to access object {key} in bucket {bucket}: {str(e)}")
+
+    cache_receipts(etag, receipts)
+    return receipts
+
+def textract_completion_handler(event, context):
+    """Finish receipts analyzed asynchronously (SNS-triggered by Textract)"""
+    try:
+        records = event['Records']
+        # One timestamp for the whole invocation
+        now = datetime.utcnow()
+
+        # A failed job must not discard the others, so collect failures
+        # and still store and notify the receipts that succeeded
+        receipts = []
+        errors = []
+        for record in records:
+            try:
+                receipts.extend(collect_textract_job(record, now))
+            except Exception as e:
+                logger.error("Error collecting Textract results: %s", e)
+                errors.append(str(e))
+
+        # Steps 2 and 3
+        if receipts:
+            finish_receipts(receipts, now)
+
+        if errors:
+            raise Exception(f"{len(errors)} of {len(records)} receipts failed: {'; '.join(errors)}")
+
+        return {
+            'statusCode': 200,
+            'body': to_json('Receipt processed successfully!')
+        }
+    except Exception as e:
+        logger.error("Error processing receipt: %s", e)
+        return {
+            'statusCode': 500,
+            'body': to_json(f'Error: {str(e)}')
+        }
+
+def collect_textract_job(record, now):
+    """Extract the receipts for one Textract completion notification"""
+    message = json.loads(record['Sns']['Message'])
+    job_id = message['JobId']
+    bucket = message['DocumentLocation']['S3Bucket']
+    key = message['DocumentLocation']['S3ObjectName']
+
+    logger.info("Textract job %s for %s/%s finished: %s", job_id, bucket, key, message['Status'])
+    if message['Status'] != 'SUCCEEDED':
+        raise Exception(f"Textract job {job_id} for {key} in bucket {bucket} did not succeed: {message['Status']}")
+
+    # Step 1: Collect the Textract results
+    response = get_textract_expense_analysis(job_id)
+    receipts = extract_receipts(response, bucket, key, now)
+    cache_receipts(message.get('JobTag'), receipts)
+    return receipts
+
+def finish_receipts(receipts, now):
+    """Store the receipts and queue their notifications"""
+    # The same object can appear twice in one event; its cache hits share a
+    # receipt_id and are true duplicates. Drop them here so the store and the
+    # notifications see the same set (BatchWriteItem also rejects duplicate
+    # keys in one request)
+    unique = {}
+    for receipt_data in receipts:
+        unique.setdefault(receipt_data['receipt_id'], receipt_data)
+    receipts = list(unique.values())
+
+    # Steps 2 and 3 are independent, so run them concurrently
+    # Step 2: Store results in DynamoDB
+    store_future = POOL.submit(store_receipts_in_dynamodb, receipts, now)
+
+    # Step 3: Queue email notifications
+    email_futures = [POOL.submit(enqueue_email_notification, receipt_data) for receipt_data in receipts]
+
+    store_future.result()
+    for email_future in email_futures:
+        email_future.result()
+
+def email_handler(event, context):
+    """Send queued email notifications (SQS-triggered)
+
+    Failed messages are reported back so that only they are retried.
+    """
+    failures = []
+    for record in event['Records']:
+        try:
+            send_email_notification(json.loads(record['body']))
+        except Exception:
+            failures.append({'itemIdentifier': record['messageId']})
+
+    return {'batchItemFailures': failures}
+
+def process_receipt_with_textract(bucket, key, now, size=None):
+    """Process receipt using Textract's AnalyzeExpense operation
+
+    Objects smaller than the Textract inline limit are read here and sent as
+    bytes, over the already open S3 connection, instead of having Textract
+    fetch them from S3 itself.
+    """
+    if size is not None and size < TEXTRACT_BYTES_LIMIT:
+        try:
+            document = {'Bytes': s3.get_object(Bucket=bucket, Key=key)['Body'].read()}
+        except Exception as e:
+            logger.error("S3 get_object call failed: %s", e)
+            raise
+    else:
+        document = {
+            'S3Object': {
+                'Bucket': bucket,
+                'Name': key
             }
-        )
-        print("Textract analyze_expense call successful")
+        }
+
+    try:
+        logger.debug("Calling Textract analyze_expense for %s/%s", bucket, key)
+        response = call_textract_with_backoff(textract.analyze_expense, Document=document)
+        logger.debug("Textract analyze_expense call successful")
     except Exception as e:
-        print(f"Textract analyze_expense call failed: {str(e)}")
+        logger.error("Textract analyze_expense call failed: %s", e)
         raise
 
-    # Generate a unique ID for this receipt
-    receipt_id = str(uuid.uuid4())
-
-    # Initialize receipt data dictionary
-    receipt_data = {
-        'receipt_id': receipt_id,
-        'date': datetime.now().strftime('%Y-%m-%d'),  # Default date
-        'vendor': 'Unknown',
-        'total': '0.00',
-        'items': [],
-        's3_path': f"s3://{bucket}/{key}"
+    return extract_receipts(response, bucket, key, now)
+
+def call_textract_with_backoff(operation, **params):
+    """Call a Textract operation, retrying throughput errors with jittered backoff"""
+    for attempt in range(TEXTRACT_MAX_ATTEMPTS):
+        try:
+            return operation(**params)
+        except textract.exceptions.ProvisionedThroughputExceededException as e:
+            if attempt == TEXTRACT_MAX_ATTEMPTS - 1:
+                raise
+            delay = min(2 ** attempt, MAX_BACKOFF_SECONDS) * random.random()
+            logger.warning("Textract throughput exceeded, retrying in %.2fs: %s", delay, e)
+            time.sleep(delay)
+
+def use_async_textract(key):
+    """Whether this object should go through asynchronous Textract analysis"""
+    return bool(TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_ROLE_ARN) and key.lower().endswith('.pdf')
+
+def start_textract_expense_analysis(bucket, key, etag=None):
+    """Start an asynchronous Textract expense analysis job"""
+    params = {
+        'DocumentLocation': {
+            'S3Object': {
+                'Bucket': bucket,
+                'Name': key
+            }
+        },
+        'NotificationChannel': {
+            'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN,
+            'RoleArn': TEXTRACT_ROLE_ARN
+        }
     }
+    # Carry the ETag through to the completion handler for the receipt cache
+    if etag:
+        params['JobTag'] = etag
 
-    # Extract data from Textract response
-    if 'ExpenseDocuments' in response and response['ExpenseDocuments']:
-        expense_doc = response['ExpenseDocuments'][0]
+    try:
+        logger.debug("Calling Textract start_expense_analysis for %s/%s", bucket, key)
+        response = call_textract_with_backoff(textract.start_expense_analysis, **params)
+        logger.info("Textract job started: %s", response['JobId'])
+    except Exception as e:
+        logger.error("Textract start_expense_analysis call failed: %s", e)
+        raise
 
-        # Process summary fields (TOTAL, DATE, VENDOR)
-        if 'SummaryFields' in expense_doc:
-            for field in expense_doc['SummaryFields']:
-                field_type = field.get('Type', {}).get('Text', '')
-                value = field.get('ValueDetection', {}).get('Text', '')
+    return response['JobId']
 
-                if field_type == 'TOTAL':
-                    receipt_data['total'] = value
-                elif field_type == 'INVOICE_RECEIPT_DATE':
-                    # Try to parse and format the date
-                    try:
-                        receipt_data['date'] = value
-                    except:
-                        # Keep the default date if parsing fails
-                        pass
-                elif field_type == 'VENDOR_NAME':
-                    receipt_data['vendor'] = value
-
-        # Process line items
-        if 'LineItemGroups' in expense_doc:
-            for group in expense_doc['LineItemGroups']:
-                if 'LineItems' in group:
-                    for line_item in group['LineItems']:
-                        item = {}
-                        for field in line_item.get('LineItemExpenseFields', []):
-                            field_type = field.get('Type', {}).get('Text', '')
-                            value = field.get('ValueDetection', {}).get('Text', '')
-
-                            if field_type == 'ITEM':
-                                item['name'] = value
-                            elif field_type == 'PRICE':
-                                item['price'] = value
-                            elif field_type == 'QUANTITY':
-                                item['quantity'] = value
-
-                        # Add to items list if we have a name
-                        if 'name' in item:
-                            receipt_data['items'].append(item)
-
-    print(f"Extracted receipt data: {json.dumps(receipt_data)}")
-    return receipt_data
-
-def store_receipt_in_dynamodb(receipt_data, bucket, key):
-    """Store the extracted receipt data in DynamoDB"""
+def get_textract_expense_analysis(job_id):
+    """Fetch all result pages of a finished Textract expense analysis job"""
+    expense_documents = []
+    params = {'JobId': job_id}
     try:
-        table = dynamodb.Table(DYNAMODB_TABLE)
-
-        # Convert items to a format DynamoDB can store
-        items_for_db = []
-        for item in receipt_data['items']:
-            items_for_db.append({
-                'name': item.get('name', 'Unknown Item'),
-                'price': item.get('price', '0.00'),
-                'quantity': item.get('quantity', '1')
-            })
-
-        # Create item to insert
-        db_item = {
-            'receipt_id': receipt_data['receipt_id'],
-            'date': receipt_data['date'],
-            'vendor': receipt_data['vendor'],
-            'total': receipt_data['total'],
-            'items': items_for_db,
-            's3_path': receipt_data['s3_path'],
-            'processed_timestamp': datetime.now().isoformat()
+        while True:
+            response = call_textract_with_backoff(textract.get_expense_analysis, **params)
+            expense_documents.extend(response.get('ExpenseDocuments', []))
+            if 'NextToken' not in response:
+                break
+            params['NextToken'] = response['NextToken']
+    except Exception as e:
+        logger.error("Textract get_expense_analysis call failed: %s", e)
+        raise
+
+    return {'ExpenseDocuments': expense_documents}
+
+def extract_receipts(response, bucket, key, now):
+    """Build receipt data from an AnalyzeExpense / GetExpenseAnalysis response
+
+    Textract returns one expense document per receipt it detects, and the
+    asynchronous API may split one receipt across several entries with the
+    same ExpenseIndex, so entries are grouped by that index and each group
+    becomes one receipt.
+    """
+    expense_docs = {}
+    for expense_doc in response.get('ExpenseDocuments', []):
+        expense_docs.setdefault(expense_doc.get('ExpenseIndex', 1), []).append(expense_doc)
+
+    # Keep one (default) receipt even when Textract found nothing
+    groups = [expense_docs[index] for index in sorted(expense_docs)] or [[]]
+
+    receipts = []
+    for group in groups:
+        # Initialize receipt data dictionary with a unique ID for this receipt
+        receipt_data = {
+            'receipt_id': str(uuid.uuid4()),
+            'date': now.strftime('%Y-%m-%d'),  # Default date
+            'vendor': 'Unknown',
+            'total': '0.00',
+            'items': [],
+            's3_path': f"s3://{bucket}/{key}"
         }
+        # Summary fields already taken from an earlier part of this receipt
+        found = set()
+
+        for expense_doc in group:
+            # Process summary fields (TOTAL, DATE, VENDOR); the first
+            # non-empty value wins
+            for field in expense_doc.get('SummaryFields', []):
+                target = SUMMARY_FIELDS.get(field.get('Type', {}).get('Text', ''))
+                value = field.get('ValueDetection', {}).get('Text', '')
+                if target and value and target not in found:
+                    receipt_data[target] = value
+                    found.add(target)
+
+            # Process line items
+            for item_group in expense_doc.get('LineItemGroups', []):
+                for line_item in item_group.get('LineItems', []):
+                    item = {}
+                    for field in line_item.get('LineItemExpenseFields', []):
+                        target = ITEM_FIELDS.get(field.get('Type', {}).get('Text', ''))
+                        if target:
+                            item[target] = field.get('ValueDetection', {}).get('Text', '')
+
+                    # Add to items list if we have a name
+                    if 'name' in item:
+                        receipt_data['items'].append(item)
+
+        logger.debug("Extracted receipt data: %s", receipt_data)
+        receipts.append(receipt_data)
+
+    return receipts
 
-        # Insert into DynamoDB
-        table.put_item(Item=db_item)
-        print(f"Receipt data stored in DynamoDB: {receipt_data['receipt_id']}")
+def get_cached_receipts(etag):
+    """Return the receipts previously extracted for this ETag, if any"""
+    if not RECEIPT_CACHE_TABLE or not etag:
+        return None
+
+    try:
+        response = dynamodb_client.get_item(TableName=RECEIPT_CACHE_TABLE, Key={'etag': {'S': etag}})
     except Exception as e:
-        print(f"Error storing data in DynamoDB: {str(e)}")
+        logger.warning("Error reading receipt cache: %s", e)
+        return None
+
+    if 'Item' not in response:
+        return None
+
+    logger.info("Receipt cache hit for ETag %s, skipping Textract", etag)
+    return DESERIALIZER.deserialize(response['Item']['receipts'])
+
+def cache_receipts(etag, receipts):
+    """Remember the extracted receipts under the object's ETag"""
+    if not RECEIPT_CACHE_TABLE or not etag:
+        return
+
+    try:
+        dynamodb_client.put_item(TableName=RECEIPT_CACHE_TABLE, Item={
+            'etag': {'S': etag},
+            'receipts': SERIALIZER.serialize(receipts)
+        })
+    except Exception as e:
+        # The cache is only an optimization, so keep processing the receipt
+        logger.warning("Error writing receipt cache: %s", e)
+
+def store_receipts_in_dynamodb(receipts, now):
+    """Store the extracted receipt data in DynamoDB
+
+    Each receipt is written as a HEADER row plus one ITEM#<n> row per line
+    item, all under the same receipt_id partition key.
+    """
+    try:
+        processed_timestamp = now.isoformat()
+
+        # Rows are built directly in DynamoDB's attribute-value format
+        requests = []
+        for receipt_data in receipts:
+            receipt_id = {'S': receipt_data['receipt_id']}
+
+            # Header row with the receipt summary
+            requests.append({'PutRequest': {'Item': {
+                'receipt_id': receipt_id,
+                'sk': {'S': 'HEADER'},
+                'date': {'S': receipt_data['date']},
+                'vendor': {'S': receipt_data['vendor']},
+                'total': {'S': receipt_data['total']},
+                'item_count': {'N': str(len(receipt_data['items']))},
+                's3_path': {'S': receipt_data['s3_path']},
+                'processed_timestamp': {'S': processed_timestamp}
+            }}})
+            for index, item in enumerate(receipt_data['items'], start=1):
+                requests.append({'PutRequest': {'Item': {
+                    'receipt_id': receipt_id,
+                    'sk': {'S': f"ITEM#{index:04d}"},
+                    'name': {'S': item.get('name', 'Unknown Item')},
+                    'price': {'S': item.get('price', '0.00')},
+                    'quantity': {'S': item.get('quantity', '1')}
+                }}})
+
+        batch_write_items(requests)
+        logger.info("Receipt data stored in DynamoDB: %s",
+                    ", ".join(receipt_data['receipt_id'] for receipt_data in receipts))
+    except Exception as e:
+        logger.error("Error storing data in DynamoDB: %s", e)
         raise
 
+def batch_write_items(requests):
+    """Write requests to the receipts table in BatchWriteItem calls of up to 25"""
+    for start in range(0, len(requests), DYNAMODB_BATCH_SIZE):
+        pending = {DYNAMODB_TABLE: requests[start:start + DYNAMODB_BATCH_SIZE]}
+        for attempt in range(DYNAMODB_MAX_ATTEMPTS):
+            response = dynamodb_client.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems')
+            if not pending:
+                break
+            if attempt == DYNAMODB_MAX_ATTEMPTS - 1:
+                raise Exception(f"DynamoDB left {len(pending[DYNAMODB_TABLE])} items unprocessed")
+            delay = min(2 ** attempt, MAX_BACKOFF_SECONDS) * random.random()
+            logger.warning("DynamoDB returned unprocessed items, retrying in %.2fs", delay)
+            time.sleep(delay)
+
 def send_email_notification(receipt_data):
     """Send an email notification with receipt details"""
     try:
         # Format items for email
-        items_html = ""
-        for item in receipt_data['items']:
-            name = item.get('name', 'Unknown Item')
-            price = item.get('price', 'N/A')
-            quantity = item.get('quantity', '1')
-            items_html += f"<li>{name} - ${price} x {quantity}</li>"
-
-        if not items_html:
-            items_html = "<li>No items detected</li>"
+        items_html = "".join(
+            f"<li>{item.get('name', 'Unknown Item')} - ${item.get('price', 'N/A')} x {item.get('quantity', '1')}</li>"
+            for item in receipt_data['items']
+        ) or "<li>No items detected</li>"
 
         # Create email body
         html_body = f"""
@@ -214,8 +573,39 @@ def send_email_notification(receipt_data):
             }
         )
 
-        print(f"Email notification sent to {SES_RECIPIENT_EMAIL}")
+        logger.info("Email notification sent to %s", SES_RECIPIENT_EMAIL)
+    except Exception as e:
+        logger.error("Error sending email notification: %s", e)
+        raise
+
+def enqueue_email_notification(receipt_data):
+    """Queue an email notification so SES latency stays off the receipt path"""
+    try:
+        if EMAIL_QUEUE_URL:
+            sqs.send_message(
+                QueueUrl=EMAIL_QUEUE_URL,
+                MessageBody=to_json(receipt_data)
+            )
+            logger.info("Email notification queued: %s", receipt_data['receipt_id'])
+        else:
+            # No queue configured, send directly
+            send_email_notification(receipt_data)
     except Exception as e:
-        print(f"Error sending email notification: {str(e)}")
+        logger.warning("Error queueing email notification: %s", e)
         # Continue execution even if email fails
-        print("Continuing execution despite email error")
\ No newline at end of file
+        logger.warning("Continuing execution despite email error")
+
+def prewarm_connections():
+    """Open connections to S3 and DynamoDB ahead of the first invocation"""
+    try:
+        s3.list_buckets()
+        dynamodb_client.describe_table(TableName=DYNAMODB_TABLE)
+        logger.info("Pre-warmed S3 and DynamoDB connections")
+    except Exception as e:
+        # Only an optimization, the handler opens connections as needed
+        logger.warning("Error pre-warming connections: %s", e)
+
+# Provisioned Concurrency initializes environments before any traffic
+# arrives, so the TLS handshakes can be paid there instead of on a request
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency':
+    prewarm_connections()
\ No newline at end of file